@@ -3,20 +3,18 @@ st.set_page_config(page_title="YouTube Audio & Whisper Transcript", page_icon="
 
 import os
 import subprocess
-import base64
 import re
+import math
+import mimetypes
 from pathlib import Path
 import time
-import json
-import requests  # For calling the YouTube Data API
-
-# --- Optional: Attempt to import whisper (for local processing) ---
-try:
-    import whisper
-except ModuleNotFoundError:
-    print("Installing openai-whisper package...")
-    subprocess.check_call(["pip", "install", "openai-whisper", "--quiet"])
-    import whisper
+import hashlib
+import heapq
+from operator import itemgetter
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import orjson
 
 # --- Load API keys from st.secrets if available ---
 @st.cache_resource
@@ -37,129 +35,422 @@ YOUTUBE_API_KEY = api_keys["youtube_api_key"]
 
 # --- Helper Functions ---
 
-def get_binary_file_downloader_html(bin_file, file_label='File'):
-    """Generate a link to download a binary file."""
-    with open(bin_file, 'rb') as f:
-        data = f.read()
-    bin_str = base64.b64encode(data).decode()
-    return f'<a href="data:application/octet-stream;base64,{bin_str}" download="{os.path.basename(file_label)}">Download {file_label}</a>'
+TRANSCRIPT_CACHE_DIR = "transcripts"
+VIDEO_ID_PATTERN = re.compile(r"(?:v=|/)([0-9A-Za-z_-]{11})")
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+TRANSCRIBE_CHUNK_SECONDS = 600
+TRANSCRIBE_MIN_CHUNK_SECONDS = 60
+TRANSCRIBE_MAX_WORKERS = 8
+TRANSCRIBE_MIN_UPLOAD_SECONDS = 1  # Whisper rejects clips under 0.1 s; shorter chunks hold no speech worth paying for
+# Trim leading silence and shorten pauses longer than half a second before upload, keeping
+# 0.2 s of each pause so phrases are not butted together. This is an energy gate, not VAD.
+SILENCE_REMOVE_FILTER = (
+    "silenceremove=start_periods=1:start_threshold=-40dB:"
+    "stop_periods=-1:stop_duration=0.5:stop_threshold=-40dB:stop_silence=0.2"
+)
+UPLOAD_AUDIO_BITRATE = "24k"
+AUDIO_EXTENSIONS = {".m4a", ".webm", ".opus", ".ogg", ".mp3"}
+COMMENTS_PAGE_SIZE = 100
+COMMENTS_CACHE_TTL = 60 * 60  # seconds
+ANALYSIS_TRANSCRIPT_CHARS = 12000
+ANALYSIS_MAX_TOKENS = 400
+# (model, context window in tokens), smallest first.
+ANALYSIS_MODELS = (("gpt-3.5-turbo", 4096), ("gpt-3.5-turbo-16k", 16385))
+CHAT_OVERHEAD_TOKENS = 16  # role/message framing added by the chat format
+LOCAL_WHISPER_MODEL = "base"
+LOCAL_WHISPER_BATCH_SIZE = 16
+PARTIAL_UPDATE_SECONDS = 0.5  # minimum gap between partial transcript updates sent to the browser
 
-def clean_filename(filename):
-    """Clean the filename to remove invalid characters."""
-    cleaned = re.sub(r'[\\/*?:"<>|]', "_", filename)
-    return cleaned.strip('. ')[:100]
+@st.cache_resource
+def get_executor():
+    """Thread pool shared across reruns for blocking background work."""
+    return ThreadPoolExecutor(max_workers=4)
+
+@st.cache_resource
+def get_transcription_executor():
+    """Separate pool for long-running background transcriptions, so they never queue ahead of downloads."""
+    return ThreadPoolExecutor(max_workers=2)
 
-def get_video_info(youtube_url):
-    """Retrieve basic video info using yt-dlp."""
+@st.cache_resource
+def get_inflight_transcriptions():
+    """Process-wide lock and dict of background transcription futures, keyed by audio fingerprint."""
+    return threading.RLock(), {}
+
+def find_downloaded_audio(output_path, video_id):
+    """Return the path of audio already downloaded for this video, if any."""
+    video_dir = os.path.join(output_path, video_id)
+    if not os.path.isdir(video_dir):
+        return None
+    for entry in os.scandir(video_dir):
+        # Skip yt-dlp's .part/.ytdl leftovers from interrupted downloads.
+        if Path(entry.name).suffix in AUDIO_EXTENSIONS:
+            return entry.path
+    return None
+
+def download_youtube_audio(youtube_url, output_path="./"):
+    """Download audio from a YouTube video using yt-dlp, reusing an earlier download of the same video."""
     try:
-        command = ["yt-dlp", "--dump-json", "--no-playlist", "--quiet", youtube_url]
-        result = subprocess.run(command, capture_output=True, text=True)
-        if result.returncode != 0:
-            return {"success": False, "error": result.stderr}
-        video_info = json.loads(result.stdout)
-        return {
-            "success": True,
-            "title": video_info.get("title", "Unknown Title"),
-            "uploader": video_info.get("uploader", "Unknown Uploader"),
-            "duration": video_info.get("duration", 0),
-            "thumbnail": video_info.get("thumbnail", "")
+        video_id = extract_video_id(youtube_url)
+        cached_file = find_downloaded_audio(output_path, video_id) if video_id else None
+        if cached_file:
+            return {
+                "success": True,
+                "file_path": cached_file,
+                "title": Path(cached_file).stem,
+                "file_name": os.path.basename(cached_file)
+            }
+        from yt_dlp import YoutubeDL
+        progress = {"percent": 0}
+
+        def update_progress(d):
+            # Runs on the worker thread, so only record state here; the script thread renders it.
+            if d["status"] == "downloading":
+                total = d.get("total_bytes") or d.get("total_bytes_estimate")
+                if total:
+                    progress["percent"] = min(int(d.get("downloaded_bytes", 0) * 100 / total), 100)
+
+        ydl_opts = {
+            "quiet": True,
+            "no_warnings": True,
+            "noplaylist": True,
+            # Keep YouTube's native audio stream; Whisper, ffmpeg and browsers all read m4a/webm,
+            # so transcoding to MP3 would only burn CPU.
+            "format": "bestaudio[ext=m4a]/bestaudio",
+            # One directory per video ID so earlier downloads can be found without scanning.
+            # yt-dlp sanitizes and truncates the title itself.
+            "outtmpl": f"{output_path}/%(id)s/%(title).100B.%(ext)s",
+            "windowsfilenames": True,
+            "progress_hooks": [update_progress]
         }
-    except Exception as e:
-        return {"success": False, "error": str(e)}
 
-def download_youtube_audio(youtube_url, output_path="./", format="mp3", quality="192"):
-    """Download audio from a YouTube video using yt-dlp."""
-    try:
-        info = get_video_info(youtube_url)
-        if not info["success"]:
-            return info
-        title = info["title"]
-        base_filename = clean_filename(title)
-        output_file = f"{output_path}/{base_filename}.{format}"
-        command = [
-            "yt-dlp", "-f", "bestaudio",
-            "--extract-audio", "--audio-format", format,
-            "--audio-quality", quality,
-            "-o", output_file,
-            "--no-playlist", "--quiet", "--progress",
-            youtube_url
-        ]
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        process = subprocess.run(command, capture_output=True, text=True)
-        if process.returncode != 0:
-            return {"success": False, "error": process.stderr}
-        progress_bar.progress(100)
-        status_text.empty()
-        if not os.path.exists(output_file):
-            potential_files = list(Path(output_path).glob(f"{base_filename}.*"))
-            if potential_files:
-                output_file = str(potential_files[0])
-            else:
-                return {"success": False, "error": "File not found after download"}
+        def run_download():
+            with YoutubeDL(ydl_opts) as ydl:
+                return ydl.extract_info(youtube_url, download=True)
+
+        with st.status("Downloading audio...", expanded=False) as status:
+            progress_bar = st.progress(0)
+            future = get_executor().submit(run_download)
+            last_percent = 0
+            while not future.done():
+                time.sleep(0.1)
+                # Only touch the widgets when the whole percentage changes.
+                if progress["percent"] > last_percent:
+                    last_percent = progress["percent"]
+                    progress_bar.progress(last_percent)
+            download_info = future.result()
+            progress_bar.progress(100)
+            status.update(label="Download complete", state="complete")
+        # yt-dlp reports the final path, so no directory scan is needed.
+        output_file = download_info["requested_downloads"][0]["filepath"]
         return {
             "success": True,
             "file_path": output_file,
-            "title": title,
+            "title": download_info.get("title", "Unknown Title"),
             "file_name": os.path.basename(output_file),
-            "duration": info["duration"]
+            "duration": download_info.get("duration", 0)
         }
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+@st.cache_resource
+def get_local_whisper_model(model_size=LOCAL_WHISPER_MODEL):
+    """Load a batched faster-whisper pipeline once per server process."""
+    from faster_whisper import BatchedInferencePipeline, WhisperModel
+    # CTranslate2 defaults to 4 CPU threads; use every core available to the server.
+    model = WhisperModel(model_size, device="auto", compute_type="int8", cpu_threads=os.cpu_count() or 4)
+    return BatchedInferencePipeline(model=model)
+
+def transcribe_locally(audio_file_path, model_size=LOCAL_WHISPER_MODEL, on_partial=None):
+    """Convert audio to text with a local faster-whisper model."""
+    model = get_local_whisper_model(model_size)
+    segments, _ = model.transcribe(
+        audio_file_path, batch_size=LOCAL_WHISPER_BATCH_SIZE, beam_size=1, vad_filter=True
+    )
+    # Segments are decoded lazily, so partial text can be shown while decoding continues.
+    # Updates are throttled, since each one resends the whole transcript so far.
+    parts = []
+    last_update = time.monotonic()
+    for segment in segments:
+        parts.append(segment.text)
+        if on_partial and time.monotonic() - last_update >= PARTIAL_UPDATE_SECONDS:
+            on_partial("".join(parts).strip())
+            last_update = time.monotonic()
+    transcript_text = "".join(parts).strip()
+    if on_partial:
+        on_partial(transcript_text)
+    return transcript_text
+
+def get_audio_duration(audio_file_path):
+    """Return the duration of an audio file in seconds using ffprobe."""
+    command = [
+        "ffprobe", "-v", "error", "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1", audio_file_path
+    ]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return float(result.stdout.strip())
+
+def chunk_duration(chunk_path):
+    """Return a chunk's duration in seconds, or 0 when ffprobe finds no audio in it."""
+    try:
+        return get_audio_duration(chunk_path)
+    except (RuntimeError, ValueError):
+        return 0.0
+
+def chunk_seconds_for(duration):
+    """Pick a chunk length that gives every transcription worker a chunk, within sane bounds."""
+    per_worker = math.ceil(duration / TRANSCRIBE_MAX_WORKERS)
+    return min(TRANSCRIBE_CHUNK_SECONDS, max(TRANSCRIBE_MIN_CHUNK_SECONDS, per_worker))
+
+def split_audio(audio_file_path, chunk_dir, segment_seconds=TRANSCRIBE_CHUNK_SECONDS):
+    """Split audio into upload-sized Opus chunks with ffmpeg, dropping silent stretches on the way."""
+    command = [
+        "ffmpeg", "-loglevel", "error", "-i", audio_file_path,
+        "-af", SILENCE_REMOVE_FILTER,
+        # Whisper resamples to 16 kHz mono anyway; low-bitrate Opus keeps uploads small.
+        "-ac", "1", "-ar", "16000", "-c:a", "libopus", "-b:a", UPLOAD_AUDIO_BITRATE,
+        "-f", "segment", "-segment_time", str(segment_seconds),
+        os.path.join(chunk_dir, "chunk_%03d.ogg")
+    ]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return sorted(str(p) for p in Path(chunk_dir).glob("chunk_*.ogg"))
+
+def transcribe_chunk(index, chunk_path, max_retries=5):
+    """Transcribe one audio chunk with the Whisper API, backing off exponentially on transient errors."""
+    import openai
+    for attempt in range(max_retries):
+        try:
+            with open(chunk_path, "rb") as audio_file:
+                transcript_response = openai.Audio.transcribe("whisper-1", audio_file)
+            return index, transcript_response["text"]
+        except (openai.error.RateLimitError, openai.error.APIConnectionError,
+                openai.error.ServiceUnavailableError, openai.error.Timeout):
+            if attempt == max_retries - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+def transcribe_with_api(audio_file_path, on_progress=None, on_partial=None):
+    """Convert audio to text with the Whisper API, transcribing chunks in parallel.
+
+    ``on_partial`` receives the transcript of the leading chunks finished so far.
+    """
+    with tempfile.TemporaryDirectory() as chunk_dir:
+        segment_seconds = chunk_seconds_for(get_audio_duration(audio_file_path))
+        chunk_paths = split_audio(audio_file_path, chunk_dir, segment_seconds)
+        # The segment muxer can leave a near-empty last chunk, and all-silent input an empty one;
+        # count those as empty text instead of uploading them.
+        texts = ["" if chunk_duration(path) < TRANSCRIBE_MIN_UPLOAD_SECONDS else None for path in chunk_paths]
+        leading = 0
+        with ThreadPoolExecutor(max_workers=TRANSCRIBE_MAX_WORKERS) as executor:
+            futures = [
+                executor.submit(transcribe_chunk, i, path)
+                for i, path in enumerate(chunk_paths) if texts[i] is None
+            ]
+            try:
+                for done, future in enumerate(as_completed(futures), start=1):
+                    index, text = future.result()
+                    texts[index] = text.strip()
+                    if on_progress:
+                        on_progress(int(done * 100 / len(futures)))
+                    previous = leading
+                    while leading < len(texts) and texts[leading] is not None:
+                        leading += 1
+                    if on_partial and leading > previous:
+                        on_partial(" ".join(filter(None, texts[:leading])))
+            except Exception:
+                # Don't upload (and pay for) queued chunks once the transcript has already failed.
+                executor.shutdown(cancel_futures=True)
+                raise
+    return " ".join(filter(None, texts))
+
+@st.cache_data(show_spinner=False)
+def audio_fingerprint(audio_file_path, mtime, size):
+    """Return a short SHA-256 fingerprint of the audio file contents.
+
+    ``mtime`` and ``size`` are only part of the cache key, so the file is rehashed only when it changes.
+    """
+    with open(audio_file_path, "rb") as f:
+        if hasattr(hashlib, "file_digest"):
+            digest = hashlib.file_digest(f, "sha256")
+        else:
+            digest = hashlib.sha256()
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()[:16]
+
+def transcribe_cached(fingerprint, model, audio_file_path, on_progress=None, on_partial=None):
+    """Transcribe audio with "whisper-1" (API) or a local faster-whisper model size.
+
+    Results are cached under TRANSCRIPT_CACHE_DIR by content fingerprint, so a re-download
+    of the same audio never pays for transcription twice. This is deliberately not an
+    st.cache_data function: the progress callbacks touch placeholders created by the caller,
+    which Streamlit cannot replay on a cache hit.
+    """
+    cache_file = os.path.join(TRANSCRIPT_CACHE_DIR, f"{fingerprint}_{model}.json")
+    if os.path.exists(cache_file):
+        return orjson.loads(Path(cache_file).read_bytes())["transcript"]
+    if model == "whisper-1":
+        transcript_text = transcribe_with_api(audio_file_path, on_progress, on_partial)
+    else:
+        transcript_text = transcribe_locally(audio_file_path, model, on_partial)
+    os.makedirs(TRANSCRIPT_CACHE_DIR, exist_ok=True)
+    # Write then rename, so a concurrent reader never sees a half-written cache file.
+    fd, tmp_path = tempfile.mkstemp(dir=TRANSCRIPT_CACHE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(orjson.dumps({"transcript": transcript_text}))
+    os.replace(tmp_path, cache_file)
+    return transcript_text
+
+def transcribe_in_background(audio_file_path):
+    """Start an API transcription with the configured key on the transcription executor.
+
+    The result lands in the transcript caches, so a later transcribe_with_whisper call returns it at once.
+    Audio that is already cached or already being transcribed is not submitted again.
+    """
+    import openai
+    openai.api_key = OPENAI_API_KEY
+    audio_stat = os.stat(audio_file_path)
+    fingerprint = audio_fingerprint(audio_file_path, audio_stat.st_mtime, audio_stat.st_size)
+    if os.path.exists(os.path.join(TRANSCRIPT_CACHE_DIR, f"{fingerprint}_whisper-1.json")):
+        return
+    lock, in_flight = get_inflight_transcriptions()
+    with lock:
+        if fingerprint in in_flight:
+            return
+        future = get_transcription_executor().submit(transcribe_cached, fingerprint, "whisper-1", audio_file_path)
+        in_flight[fingerprint] = future
+
+    def forget(done_future):
+        with lock:
+            if in_flight.get(fingerprint) is done_future:
+                del in_flight[fingerprint]
+
+    future.add_done_callback(forget)
+
+def claim_background_transcription(fingerprint):
+    """Return the running background transcription for this audio, if any.
+
+    A transcription still queued behind other jobs is cancelled instead, so the caller can run it
+    right away rather than wait for the shared executor.
+    """
+    lock, in_flight = get_inflight_transcriptions()
+    with lock:
+        future = in_flight.get(fingerprint)
+        if future is None or future.cancel():
+            return None
+        return future
+
 def transcribe_with_whisper(audio_file_path):
-    """Convert audio to text using OpenAI's Whisper API."""
+    """Convert audio to text using OpenAI's Whisper API, or locally if no API key is available."""
     import openai
     # Use the API key from secrets or prompt the user if not found.
     api_key = OPENAI_API_KEY if OPENAI_API_KEY else st.text_input("Enter your OpenAI API Key", type="password", key="openai_api_key")
-    if not api_key:
-        st.error("OpenAI API key is required for transcription.")
-        return {"success": False, "error": "No OpenAI API key provided"}
-    openai.api_key = api_key
-    st.info("Transcribing audio using OpenAI Whisper API. Please wait...")
+    if api_key:
+        openai.api_key = api_key
+        model = "whisper-1"
+        st.info("Transcribing audio using OpenAI Whisper API. Please wait...")
+    else:
+        model = LOCAL_WHISPER_MODEL
+        st.info("Transcribing audio locally with faster-whisper. Please wait...")
+    progress_bar = st.progress(0)
+    partial_text = st.empty()
     try:
-        with open(audio_file_path, "rb") as audio_file:
-            transcript_response = openai.Audio.transcribe("whisper-1", audio_file)
-        transcript_text = transcript_response["text"]
+        audio_stat = os.stat(audio_file_path)
+        fingerprint = audio_fingerprint(audio_file_path, audio_stat.st_mtime, audio_stat.st_size)
+        future = claim_background_transcription(fingerprint) if model == "whisper-1" else None
+        if future is not None:
+            # Reuse the transcription started after download rather than paying for a second run.
+            with st.spinner("Finishing the transcript started after download..."):
+                return {"success": True, "transcript": future.result()}
+        transcript_text = transcribe_cached(
+            fingerprint, model, audio_file_path,
+            on_progress=progress_bar.progress, on_partial=partial_text.markdown
+        )
         return {"success": True, "transcript": transcript_text}
     except Exception as e:
-        return {"success": False, "error": f"Error transcribing audio with OpenAI: {str(e)}"}
+        return {"success": False, "error": f"Error transcribing audio with {model}: {str(e)}"}
+    finally:
+        progress_bar.empty()
+        partial_text.empty()
 
 def extract_video_id(url):
     """Extract the video ID from a YouTube URL."""
-    regex = r"(?:v=|\/)([0-9A-Za-z_-]{11}).*"
-    match = re.search(regex, url)
+    match = VIDEO_ID_PATTERN.search(url)
     if match:
         return match.group(1)
     return None
 
-def get_youtube_comments(video_id, api_key, max_results=100):
-    """Fetch top comments for a video using YouTube Data API v3 and sort by like count."""
+@st.cache_resource
+def get_http_session():
+    """Create a keep-alive HTTP session shared across reruns for YouTube Data API calls."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_data(ttl=COMMENTS_CACHE_TTL, show_spinner=False)
+def _fetch_comments(video_id, max_results, _api_key):
+    """Fetch comment threads for a video, cached per video ID (the API key is not part of the key)."""
+    session = get_http_session()
     api_url = "https://www.googleapis.com/youtube/v3/commentThreads"
     params = {
         "part": "snippet",
         "videoId": video_id,
-        "maxResults": max_results,
+        "maxResults": min(max_results, COMMENTS_PAGE_SIZE),
         "order": "relevance",
         "textFormat": "plainText",
-        "key": api_key
+        # Ask the API to return only the fields read below.
+        "fields": "items(snippet/topLevelComment/snippet(authorDisplayName,textDisplay,likeCount)),nextPageToken",
+        "key": _api_key
     }
-    response = requests.get(api_url, params=params)
-    if response.status_code != 200:
-        return {"success": False, "error": f"HTTP error {response.status_code}: {response.text}"}
-    data = response.json()
     comments = []
-    for item in data.get("items", []):
-        snippet = item["snippet"]["topLevelComment"]["snippet"]
-        author = snippet.get("authorDisplayName", "Unknown")
-        text = snippet.get("textDisplay", "")
-        like_count = snippet.get("likeCount", 0)
-        comments.append({"author": author, "text": text, "likeCount": like_count})
-    # Sort comments by like count (highest first)
-    comments_sorted = sorted(comments, key=lambda x: x["likeCount"], reverse=True)
-    comments_sorted = comments_sorted[:max_results]
+    # The API returns at most 100 threads per page; follow nextPageToken for more.
+    while len(comments) < max_results:
+        response = session.get(api_url, params=params)
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP error {response.status_code}: {response.text}")
+        data = orjson.loads(response.content)
+        for item in data.get("items", []):
+            snippet = item["snippet"]["topLevelComment"]["snippet"]
+            author = snippet.get("authorDisplayName", "Unknown")
+            text = snippet.get("textDisplay", "")
+            like_count = snippet.get("likeCount", 0)
+            comments.append({"author": author, "text": text, "likeCount": like_count})
+        if "nextPageToken" not in data:
+            break
+        params["pageToken"] = data["nextPageToken"]
+    return comments
+
+def get_youtube_comments(video_id, api_key, max_results=100):
+    """Fetch top comments for a video using YouTube Data API v3 and sort by like count."""
+    try:
+        comments = _fetch_comments(video_id, max_results, api_key)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+    # Keep the most-liked comments (highest first) without sorting the whole list.
+    comments_sorted = heapq.nlargest(max_results, comments, key=itemgetter("likeCount"))
     return {"success": True, "comments": comments_sorted}
 
+@st.cache_resource
+def get_tokenizer():
+    """Load the tiktoken encoding used by the analysis models once per server process."""
+    import tiktoken
+    return tiktoken.encoding_for_model("gpt-3.5-turbo")
+
+def condense_transcript(transcript, max_chars=ANALYSIS_TRANSCRIPT_CHARS):
+    """Shorten a transcript to roughly max_chars by keeping evenly spaced sentences."""
+    if len(transcript) <= max_chars:
+        return transcript
+    sentences = SENTENCE_BOUNDARY.split(transcript)
+    keep_every = math.ceil(len(transcript) / max_chars)
+    # Unpunctuated transcripts split into few sentences, so cap the length regardless.
+    return " ".join(sentences[::keep_every])[:max_chars]
+
 def analyze_comments_and_transcript(transcript, comments):
     """Use OpenAI to analyze the transcript and comments to determine what viewers find useful."""
     import openai
@@ -168,34 +459,60 @@ def analyze_comments_and_transcript(transcript, comments):
         st.error("OpenAI API key is required for analysis.")
         return None
     openai.api_key = api_key
-    # Prepare the prompt by joining all comments with like counts.
-    comments_text = "\n".join([f"{c['author']}: {c['text']} (Likes: {c['likeCount']})" for c in comments])
-    prompt = (
+    system_prompt = "You are a helpful assistant analyzing video transcripts and comments."
+    instructions = (
         "Below is the transcript of a YouTube video and the top comments (sorted by likes) from viewers. "
         "Analyze the comments to identify and list the specific aspects of the video that people are finding useful. "
         "Use the transcript to help find correlations between the content and the feedback. "
         "Present your findings as a bullet-point list of common themes or features mentioned in the comments.\n\n"
-        "Transcript:\n"
-        f"{transcript}\n\n"
-        "Comments:\n"
-        f"{comments_text}\n\n"
-        "Findings:"
     )
+    condensed = condense_transcript(transcript)
+    transcript_label = "Transcript (condensed):\n" if condensed != transcript else "Transcript:\n"
+    # Count tokens exactly and pick the smallest model whose context fits; truncate the transcript
+    # on a token boundary if even the largest one does not.
+    encoding = get_tokenizer()
+    largest_budget = ANALYSIS_MODELS[-1][1] - ANALYSIS_MAX_TOKENS
+    comment_lines = [f"{c['author']}: {c['text']} (Likes: {c['likeCount']})" for c in comments]
+    # Everything in the final prompt except the comments and the transcript itself.
+    fixed_tokens = len(encoding.encode(system_prompt + instructions + transcript_label + "\n\nComments:\n\n\nFindings:")) + CHAT_OVERHEAD_TOKENS
+    comment_tokens = [len(encoding.encode(line + "\n")) for line in comment_lines]
+    total_tokens = fixed_tokens + sum(comment_tokens)
+    # Comments arrive sorted by likes, so drop the least-liked ones if they alone overflow the context.
+    while comment_lines and total_tokens > largest_budget:
+        comment_lines.pop()
+        total_tokens -= comment_tokens.pop()
+    comments_section = "\n\nComments:\n" + "\n".join(comment_lines) + "\n\nFindings:"
+    fixed_tokens = len(encoding.encode(system_prompt + instructions + transcript_label + comments_section)) + CHAT_OVERHEAD_TOKENS
+    transcript_tokens = encoding.encode(condensed)
+    for model, context_window in ANALYSIS_MODELS:
+        budget = context_window - ANALYSIS_MAX_TOKENS - fixed_tokens
+        if len(transcript_tokens) <= budget:
+            break
+    transcript_text = encoding.decode(transcript_tokens[:max(budget, 0)])
+    prompt = f"{instructions}{transcript_label}{transcript_text}{comments_section}"
+    partial_analysis = st.empty()
     try:
         response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
+            model=model,
             messages=[
-                {"role": "system", "content": "You are a helpful assistant analyzing video transcripts and comments."},
+                {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.5,
-            max_tokens=400,
+            max_tokens=ANALYSIS_MAX_TOKENS,
+            stream=True,
         )
-        analysis = response["choices"][0]["message"]["content"]
+        # Render tokens as they arrive instead of waiting for the full completion.
+        analysis = ""
+        for chunk in response:
+            analysis += chunk["choices"][0]["delta"].get("content", "")
+            partial_analysis.markdown(analysis)
         return analysis
     except Exception as e:
         st.error(f"Error during analysis: {str(e)}")
         return None
+    finally:
+        partial_analysis.empty()
 
 # --- Streamlit Application UI ---
 
@@ -209,11 +526,19 @@ youtube_url = st.text_input("YouTube URL", placeholder="https://www.youtube.com/
 
 if st.button("Download Audio"):
     if youtube_url:
+        # Fetch comments alongside the download when a YouTube API key is configured.
+        video_id = extract_video_id(youtube_url)
+        if video_id and YOUTUBE_API_KEY:
+            comments_future = get_executor().submit(get_youtube_comments, video_id, YOUTUBE_API_KEY)
+            st.session_state.comments_future = (video_id, comments_future)
         download_result = download_youtube_audio(youtube_url, output_path="downloads")
         if download_result["success"]:
             st.success("Audio downloaded successfully!")
-            st.audio(download_result["file_path"])
+            st.audio(download_result["file_path"], format=mimetypes.guess_type(download_result["file_path"])[0] or "audio/mp4")
             st.session_state.audio_file = download_result["file_path"]
+            # Start transcribing right away when no key prompt is needed.
+            if OPENAI_API_KEY:
+                transcribe_in_background(download_result["file_path"])
         else:
             st.error(f"Error downloading audio: {download_result['error']}")
     else:
@@ -242,14 +567,20 @@ if st.button("Show Top 100 Comments"):
                 st.error("YouTube API key is required to fetch comments.")
             else:
                 st.info("Fetching top comments. Please wait...")
-                comments_result = get_youtube_comments(video_id, youtube_api_key)
+                prefetched = st.session_state.pop("comments_future", None)
+                if prefetched and prefetched[0] == video_id:
+                    comments_result = prefetched[1].result()
+                else:
+                    comments_result = get_youtube_comments(video_id, youtube_api_key)
                 if comments_result["success"]:
                     comments = comments_result["comments"]
                     st.session_state.comments = comments  # store comments for later analysis
                     st.success(f"Fetched {len(comments)} comments.")
                     with st.expander("Top Comments"):
-                        for comment in comments:
-                            st.write(f"{comment['author']}: {comment['text']} (Likes: {comment['likeCount']})")
+                        # One table element instead of one st.write per comment; cells are
+                        # rendered as plain text, so comment markup cannot leak into other rows.
+                        import pandas as pd
+                        st.dataframe(pd.DataFrame(comments), use_container_width=True, hide_index=True)
                 else:
                     st.error(f"Error fetching comments: {comments_result['error']}")
     else: